@@ -1,12 +1,19 @@
 import requests
 import logging
 import random
+import re
 import time
+from collections import deque
+from itertools import islice
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
 from fake_useragent import UserAgent
 from pydantic import BaseModel, ValidationError
 from typing import List, Optional
-from bs4 import BeautifulSoup
+from lxml import etree
+import hashlib
 import json
+import orjson
 import os
 import dotenv
 from playwright.sync_api import sync_playwright
@@ -17,6 +24,123 @@ logging.basicConfig(
     level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
 )
 
+_SYS_PROMPT_NAV = """
+You are an expert agent named MULTI·ON developed by "MultiOn" controlling a browser (you are not just a language model anymore).
+You are given:
+1. An objective that you are trying to achieve: {objective}
+
+Start with navigation by using "GOTO_URL" followed by the URL.
+After navigation, inspect the page and issue the next commands based on the available elements.
+
+IMPORTANT:
+- Do not assume elements exist before seeing the page.
+- Use the available elements after loading the page.
+
+{plan}
+
+{history}
+
+The output MUST be a JSON object following this structure:
+{{
+    "PLAN": [
+        {{
+            "step_desc": "Description of the step",
+            "command": "Command to be executed (e.g., GOTO_URL https://example.com)"
+        }}
+    ],
+    "pageContextObjects": {{}},
+    "userInfo": {{}},
+    "status": "DONE"
+}}
+"""
+
+_SYS_PROMPT_INTERACT = """
+You are an expert agent named MULTI·ON developed by "MultiOn" controlling a browser.
+You have successfully navigated to the page. The next steps involve interacting with the page elements.
+
+{elements}
+
+{plan}
+
+Based on the elements, choose appropriate actions like CLICK, TYPE, SUBMIT, etc.
+
+{history}
+
+The output MUST be a JSON object following this structure:
+{{
+    "PLAN": [
+        {{
+            "step_desc": "Description of the step",
+            "command": "Command to be executed (e.g., CLICK input_placeholder_0)"
+        }}
+    ],
+    "pageContextObjects": {{}},
+    "userInfo": {{}},
+    "status": "DONE"
+}}
+"""
+
+_SYS_PROMPT_PAGE = """
+You are an expert agent named MULTI·ON developed by "MultiOn" controlling a browser.
+You opened {url} while working towards this objective: {objective}
+
+{content}
+
+Extract the information on this page that is relevant to the objective into "pageContextObjects".
+
+The output MUST be a JSON object following this structure:
+{{
+    "PLAN": [
+        {{
+            "step_desc": "Description of what was found on the page",
+            "command": ""
+        }}
+    ],
+    "pageContextObjects": {{}},
+    "userInfo": {{}},
+    "status": "DONE"
+}}
+"""
+
+_WORD_RE = re.compile(r"\S+")
+
+def _first_n_words(text, n):
+    return " ".join(
+        match.group() for match in islice(_WORD_RE.finditer(text), n)
+    )
+
+def _split_first(text):
+    parts = text.split(None, 1)
+    if not parts:
+        return "", ""
+    return parts[0], parts[1] if len(parts) > 1 else ""
+
+class _VisibleTextTarget:
+    """ lxml parser target that collects text outside non-visible elements. """
+
+    SKIP_TAGS = {"script", "style", "meta", "link", "noscript"}
+
+    def __init__(self):
+        self.chunks = []
+        self.skip_depth = 0
+
+    def start(self, tag, attrib):
+        self.chunks.append(" ")
+        if tag in self.SKIP_TAGS:
+            self.skip_depth += 1
+
+    def end(self, tag):
+        self.chunks.append(" ")
+        if tag in self.SKIP_TAGS and self.skip_depth > 0:
+            self.skip_depth -= 1
+
+    def data(self, data):
+        if self.skip_depth == 0:
+            self.chunks.append(data)
+
+    def close(self):
+        return " ".join("".join(self.chunks).split())
+
 class PlanStep(BaseModel):
     step_desc: str
     command: str
@@ -31,52 +155,160 @@ class PlaywrightAutomation:
 
     OLLAMA_BASE_URL = "http://localhost:11434/api"
     MODEL_NAME = "phi3:14b"
+    MAX_RESPONSE_TOKENS = 2048
     GOOGLE_API_KEY = os.environ.get("GOOGLE_API_KEY")
     GOOGLE_SEARCH_CX = os.environ.get("GOOGLE_SEARCH_CX")
 
     user_profiles = {}
     session_data = {}
 
+    _ua = None
+
+    BROWSER_ARGS = [
+        "--disable-gpu",
+        "--disable-dev-shm-usage",
+        "--disable-extensions",
+        "--disable-background-networking",
+        "--disable-default-apps",
+        "--disable-sync",
+        "--no-first-run",
+        "--no-zygote",
+        "--no-sandbox",
+        "--mute-audio",
+        "--blink-settings=imagesEnabled=false",
+    ]
+
+    SESSION_HISTORY_STEPS = 3
+    PAGE_CONTENT_CHARS = 4000
+    BODY_TEXT_TIMEOUT_MS = 1000
+    PROFILE_FLUSH_INTERVAL = 10
+
+    TERMINAL_ACTIONS = {"GOOGLE_SEARCH_API"}
+    PAGE_INTERACTION_ACTIONS = {"CLICK", "TYPE", "SUBMIT"}
+
+    BLOCKED_RESOURCE_TYPES = {"image", "media", "font", "stylesheet"}
+
+    INTERACTABLE_ELEMENTS_JS = """() => {
+        const out = {inputs: [], buttons: [], links: []};
+        const visit = (root) => {
+            for (const e of root.querySelectorAll("*")) {
+                switch (e.tagName) {
+                    case "INPUT":
+                        out.inputs.push({
+                            placeholder: e.getAttribute("placeholder"),
+                            name: e.getAttribute("name"),
+                        });
+                        break;
+                    case "BUTTON":
+                        out.buttons.push({
+                            aria_label: e.getAttribute("aria-label"),
+                            text: e.innerText.trim(),
+                        });
+                        break;
+                    case "A":
+                        out.links.push({
+                            href: e.getAttribute("href"),
+                            text: e.innerText.trim(),
+                        });
+                        break;
+                }
+                if (e.shadowRoot) {
+                    visit(e.shadowRoot);
+                }
+            }
+        };
+        visit(document);
+        return out;
+    }"""
+
+    PAGE_FINGERPRINT_JS = (
+        "() => document.getElementsByTagName('*').length + '|' + location.href"
+    )
+
+    def __init__(self, headless=True):
+        self.headless = headless
+        self._http = requests.Session()
+        self._pw = None
+        self._browser = None
+        self._profile_cache = {}
+        self._dirty_profiles = set()
+        self._elements_cache = {}
+
+    def _ensure_browser(self):
+        if self._browser is None:
+            self._pw = sync_playwright().start()
+            self._browser = self._pw.chromium.launch(
+                headless=self.headless, args=self.BROWSER_ARGS
+            )
+        return self._browser
+
+    def close(self):
+        if self._browser is not None:
+            self._browser.close()
+            self._browser = None
+        if self._pw is not None:
+            self._pw.stop()
+            self._pw = None
+        self._http.close()
+
+    def route_request(self, route):
+        if route.request.resource_type in self.BLOCKED_RESOURCE_TYPES:
+            route.abort()
+        else:
+            route.continue_()
+
     def get_random_user_agent(self):
-        ua = UserAgent()
-        return ua.random
+        cls = type(self)
+        if cls._ua is None:
+            cls._ua = UserAgent()
+        return cls._ua.random
 
     def load_user_profile(self, user_id):
         profile_path = f"profiles/{user_id}.json"
         if os.path.exists(profile_path):
-            with open(profile_path, "r") as f:
-                return json.load(f)
+            with open(profile_path, "rb") as f:
+                return orjson.loads(f.read())
         else:
             return {"user_id": user_id, "preferences": {}, "session_history": []}
 
     def save_user_profile(self, user_id, profile_data):
         os.makedirs("profiles", exist_ok=True)
         profile_path = f"profiles/{user_id}.json"
-        with open(profile_path, "w") as f:
-            json.dump(profile_data, f)
+        with open(profile_path, "wb") as f:
+            f.write(orjson.dumps(profile_data))
 
     def send_to_model(self, prompt):
+        """ Send one prompt, or a list of prompts dispatched concurrently.
+
+        Ollama batches requests that are in flight at the same time into one
+        forward pass when started with OLLAMA_NUM_PARALLEL=2 (or higher).
+        """
+        if isinstance(prompt, str):
+            return self._generate(prompt)
+
+        with ThreadPoolExecutor(max_workers=max(len(prompt), 1)) as executor:
+            return list(executor.map(self._generate, prompt))
+
+    def _generate(self, prompt):
         try:
-            response = requests.post(
+            with self._http.post(
                 f"{self.OLLAMA_BASE_URL}/generate",
                 json={
                     "model": self.MODEL_NAME,
                     "prompt": prompt,
                     "format": "json",
-                    "stream": False,
+                    "stream": True,
                 },
-            )
-
-            response.raise_for_status()
-
-            result = response.json()
-            raw_response = result.get("response", "")
+                stream=True,
+            ) as response:
+                response.raise_for_status()
+                raw_response = self._read_json_stream(response)
 
             print("Raw response from model:", raw_response)
 
-            parsed_response = json.loads(raw_response)
+            parsed_response, _ = json.JSONDecoder().raw_decode(raw_response.strip())
 
-            print("Parsed response:", json.dumps(parsed_response, indent=2))
+            print("Parsed response:", orjson.dumps(parsed_response, option=orjson.OPT_INDENT_2).decode())
 
             return CommandOutput(**parsed_response)
 
@@ -90,6 +322,47 @@ class PlaywrightAutomation:
             print(f"Exception: {e}")
             return None
 
+    def _read_json_stream(self, response):
+        """ Accumulate streamed tokens until the top-level JSON object closes.
+
+        Leaving the stream early closes the connection, which makes Ollama stop
+        generating; MAX_RESPONSE_TOKENS bounds runaway generations.
+        """
+        chunks = []
+        depth = 0
+        started = in_string = escaped = False
+
+        for tokens, line in enumerate(response.iter_lines(), start=1):
+            if not line:
+                continue
+            result = orjson.loads(line)
+            piece = result.get("response", "")
+            chunks.append(piece)
+
+            for char in piece:
+                if escaped:
+                    escaped = False
+                elif in_string:
+                    if char == "\\":
+                        escaped = True
+                    elif char == '"':
+                        in_string = False
+                elif char == '"':
+                    in_string = True
+                elif char == "{":
+                    depth += 1
+                    started = True
+                elif char == "}":
+                    depth -= 1
+
+            if result.get("done") or (started and depth == 0):
+                break
+            if tokens >= self.MAX_RESPONSE_TOKENS:
+                logging.warning("Model response exceeded token budget, truncating.")
+                break
+
+        return "".join(chunks)
+
     def process_model_output(self, output):
         if output is None:
             return [], "", "NOT SURE"
@@ -104,29 +377,49 @@ class PlaywrightAutomation:
             logging.error(f"Attribute error in model output processing: {e}")
             return [], "", "NOT SURE"
 
+    def serialize_plan(self, plan):
+        return orjson.dumps([step.dict() for step in plan])
+
+    def plan_digest(self, plan_bytes):
+        return hashlib.blake2b(plan_bytes, digest_size=16).digest()
+
     def check_for_stagnation(self, previous_plan, current_plan):
         return previous_plan == current_plan
 
     def get_simplified_browser_content(self, page):
-        page_source = page.content()
-        soup = BeautifulSoup(page_source, "html.parser")
+        try:
+            body_text = page.inner_text("body", timeout=self.BODY_TEXT_TIMEOUT_MS)
+            return " ".join(body_text.split())
+        except Exception as e:
+            logging.warning(f"Falling back to parsing page HTML: {e}")
 
-        for script in soup(["script", "style", "meta", "link", "noscript"]):
-            script.decompose()
+        page_source = page.content()
+        try:
+            cleaned_text = etree.fromstring(
+                page_source, etree.HTMLParser(target=_VisibleTextTarget())
+            )
+        except (etree.LxmlError, ValueError) as e:
+            logging.error(f"Error parsing page content: {e}")
+            return ""
 
-        visible_text = soup.get_text(separator=" ", strip=True)
-        cleaned_text = " ".join(visible_text.split())
+        return cleaned_text or ""
 
-        return cleaned_text
+    def clear_elements_cache(self, frame):
+        if frame.parent_frame is None:
+            self._elements_cache.clear()
 
     def get_all_interactable_elements(self, page):
         elements = {}
         try:
+            fingerprint = page.evaluate(self.PAGE_FINGERPRINT_JS)
+            if fingerprint in self._elements_cache:
+                return self._elements_cache[fingerprint]
+
+            data = page.evaluate(self.INTERACTABLE_ELEMENTS_JS)
 
-            input_fields = page.query_selector_all("input")
-            for i, input_field in enumerate(input_fields):
-                placeholder = input_field.get_attribute("placeholder")
-                name = input_field.get_attribute("name")
+            for i, input_field in enumerate(data["inputs"]):
+                placeholder = input_field["placeholder"]
+                name = input_field["name"]
                 if placeholder:
                     elements[f"input_placeholder_{i}"] = (
                         f'input[placeholder="{placeholder}"]'
@@ -136,10 +429,9 @@ class PlaywrightAutomation:
                 else:
                     elements[f"input_{i}"] = f"input:nth-of-type({i + 1})"
 
-            buttons = page.query_selector_all("button")
-            for i, button in enumerate(buttons):
-                aria_label = button.get_attribute("aria-label")
-                text = button.inner_text().strip()
+            for i, button in enumerate(data["buttons"]):
+                aria_label = button["aria_label"]
+                text = button["text"]
                 if aria_label:
                     elements[f"button_aria_label_{i}"] = (
                         f'button[aria-label="{aria_label}"]'
@@ -149,10 +441,9 @@ class PlaywrightAutomation:
                 else:
                     elements[f"button_{i}"] = f"button:nth-of-type({i + 1})"
 
-            links = page.query_selector_all("a")
-            for i, link in enumerate(links):
-                href = link.get_attribute("href")
-                text = link.inner_text().strip()
+            for i, link in enumerate(data["links"]):
+                href = link["href"]
+                text = link["text"]
                 if text:
                     elements[f"link_text_{i}"] = f'a:has-text("{text}")'
                 elif href:
@@ -160,6 +451,7 @@ class PlaywrightAutomation:
                 else:
                     elements[f"link_{i}"] = f"a:nth-of-type({i + 1})"
 
+            self._elements_cache[fingerprint] = elements
             return elements
 
         except Exception as e:
@@ -178,6 +470,65 @@ class PlaywrightAutomation:
         logging.warning("No relevant search result found.")
         return None
 
+    def _goto_url(self, page, args, elements):
+        url, _ = _split_first(args)
+        if not url:
+            logging.warning("Unknown command or insufficient parameters: GOTO_URL")
+        else:
+            page.goto(url)
+            logging.info(f"Navigated to {url}")
+
+    def _click(self, page, args, elements):
+        element_name, _ = _split_first(args)
+        if not element_name:
+            logging.warning("Unknown command or insufficient parameters: CLICK")
+        elif element_name in elements:
+            page.click(elements[element_name])
+            logging.info(f"Clicked on {element_name}")
+        else:
+            logging.warning(f"No mapped element found for {element_name}")
+
+    def _type(self, page, args, elements):
+        element_name, text = _split_first(args)
+        text = text.strip()
+        if not element_name or not text:
+            logging.warning(f"Unknown command or insufficient parameters: TYPE {args}")
+        elif element_name in elements:
+            page.fill(elements[element_name], text)
+            logging.info(f"Typed '{text}' into {element_name}")
+        else:
+            logging.warning(f"No mapped element found for {element_name}")
+
+    def _submit(self, page, args, elements):
+        element_name, _ = _split_first(args)
+        if not element_name:
+            logging.warning("Unknown command or insufficient parameters: SUBMIT")
+        elif element_name in elements:
+            page.press(elements[element_name], "Enter")
+            logging.info(f"Submitted form via {element_name}")
+        else:
+            logging.warning(f"No mapped element found for {element_name}")
+
+    def _google_search_api(self, page, args, elements):
+        logging.info(f"Executing Google Search API with query: {args}")
+        search_results = self.google_search(args)
+        logging.info("Search results retrieved via API")
+
+        search_results_summary = "\n".join(
+            [f"Title: {item['title']}\nURL: {item['link']}" for item in search_results]
+        )
+        logging.info(f"Search results summary provided to LLM:\n{search_results_summary}")
+
+        return search_results
+
+    _COMMAND_HANDLERS = {
+        "GOTO_URL": _goto_url,
+        "CLICK": _click,
+        "TYPE": _type,
+        "SUBMIT": _submit,
+        "GOOGLE_SEARCH_API": _google_search_api,
+    }
+
     def execute_browser_commands(self, page, commands, elements):
         try:
             for command in commands:
@@ -185,67 +536,98 @@ class PlaywrightAutomation:
                     logging.warning("Empty command found, skipping...")
                     continue
 
-                parts = command.split()
-                action = parts[0]
-
-                if action == "GOTO_URL":
-                    page.goto(parts[1])
-                    logging.info(f"Navigated to {parts[1]}")
-                elif action == "CLICK" and len(parts) > 1:
-                    element_name = parts[1]
-                    if element_name in elements:
-                        page.click(elements[element_name])
-                        logging.info(f"Clicked on {element_name}")
-                    else:
-                        logging.warning(f"No mapped element found for {element_name}")
-                elif action == "TYPE" and len(parts) > 2:
-                    element_name = parts[1]
-                    text = " ".join(parts[2:])
-                    if element_name in elements:
-                        page.fill(elements[element_name], text)
-                        logging.info(f"Typed '{text}' into {element_name}")
-                    else:
-                        logging.warning(f"No mapped element found for {element_name}")
-                elif action == "SUBMIT" and len(parts) > 1:
-                    element_name = parts[1]
-                    if element_name in elements:
-                        page.press(elements[element_name], "Enter")
-                        logging.info(f"Submitted form via {element_name}")
-                    else:
-                        logging.warning(f"No mapped element found for {element_name}")
-                elif action == "GOOGLE_SEARCH_API":
-                    
-                    logging.info(f"Executing Google Search API with query: {' '.join(parts[1:])}")
-                    search_results = self.google_search(" ".join(parts[1:]))
-                    logging.info("Search results retrieved via API")
-                    
-                    search_results_summary = "\n".join(
-                        [f"Title: {item['title']}\nURL: {item['link']}" for item in search_results]
-                    )
-                    logging.info(f"Search results summary provided to LLM:\n{search_results_summary}")
-
-                    return search_results  
-                else:
+                action, args = _split_first(command)
+                handler = self._COMMAND_HANDLERS.get(action)
+                if handler is None:
                     logging.warning(f"Unknown command or insufficient parameters: {command}")
+                    continue
+
+                result = handler(self, page, args.strip(), elements)
+                if action in self.PAGE_INTERACTION_ACTIONS:
+                    self._elements_cache.clear()
+                if result is not None:
+                    return result
         except Exception as e:
             logging.error(f"Execution error: {e}")
 
 
+    def independent_urls(self, commands):
+        # Heuristic: a plan made only of GOTO_URL commands is treated as
+        # independent visits when every URL has a distinct origin. URLs on a
+        # shared origin may depend on each other (e.g. login, then account) and
+        # need the cookies of one context, so they stay on the sequential path.
+        urls = []
+        origins = set()
+        for command in commands:
+            action, args = _split_first(command)
+            if action != "GOTO_URL":
+                return []
+            url, _ = _split_first(args)
+            if url in urls:
+                continue
+            parts = urlsplit(url)
+            origin = (parts.scheme, parts.netloc)
+            if origin in origins:
+                return []
+            origins.add(origin)
+            urls.append(url)
+        return urls if len(urls) > 1 else []
+
+    def visit_urls_in_parallel(self, browser, urls):
+        contexts = []
+        pages = {}
+        contents = {}
+        try:
+            for url in urls:
+                context = browser.new_context()
+                contexts.append(context)
+                page = context.new_page()
+                page.route("**/*", self.route_request)
+                try:
+                    page.goto(url, wait_until="commit")
+                    pages[url] = page
+                except Exception as e:
+                    logging.error(f"Error navigating to {url}: {e}")
+
+            for url, page in pages.items():
+                try:
+                    page.wait_for_load_state()
+                    contents[url] = self.get_simplified_browser_content(page)
+                    logging.info(f"Navigated to {url}")
+                except Exception as e:
+                    logging.error(f"Error loading {url}: {e}")
+        finally:
+            for context in contexts:
+                context.close()
+
+        return contents
+
+    def get_cached_profile(self, user_id):
+        if user_id not in self._profile_cache:
+            self._profile_cache[user_id] = self.load_user_profile(user_id)
+        return self._profile_cache[user_id]
+
+    def flush_profiles(self):
+        for user_id in self._dirty_profiles:
+            self.save_user_profile(user_id, self._profile_cache[user_id])
+        self._dirty_profiles.clear()
+
     def manage_session(self, user_id, action, data=None):
-        global session_data
         if action == "load":
-            session_data = self.load_user_profile(user_id).get("session_history", [])
+            profile_data = self.get_cached_profile(user_id)
+            self.session_data = profile_data.setdefault("session_history", [])
+            return self.session_data
         elif action == "save":
-            profile_data = self.load_user_profile(user_id)
-            profile_data["session_history"].append(data)
-            self.save_user_profile(user_id, profile_data)
+            profile_data = self.get_cached_profile(user_id)
+            profile_data.setdefault("session_history", []).append(data)
+            self._dirty_profiles.add(user_id)
         elif action == "clear":
-            session_data = []
+            self.session_data = []
 
     def google_search(self, query):
         try:
 
-            simplified_query = " ".join(query.split()[:10])
+            simplified_query = _first_n_words(query, 10)
 
             url = "https://www.googleapis.com/customsearch/v1"
             params = {
@@ -257,7 +639,7 @@ class PlaywrightAutomation:
             full_url = requests.Request("GET", url, params=params).prepare().url
             logging.info(f"Google Search API Request URL: {full_url}")
 
-            response = requests.get(url, params=params)
+            response = self._http.get(url, params=params)
             response.raise_for_status()
 
             search_results = response.json()
@@ -271,7 +653,7 @@ class PlaywrightAutomation:
             logging.error(f"Error during Google search: {e}")
         return []
 
-    def generate_final_output(self, model_output, search_results=None):
+    def generate_final_output(self, model_output, search_results=None, page_context=None):
         """ Generate a final output summary based on the model's last response. """
         try:
             plan_summary = "\n".join([f"Step: {step.step_desc}" for step in model_output.PLAN])
@@ -281,8 +663,19 @@ class PlaywrightAutomation:
                     [f"Title: {item['title']}\nURL: {item['link']}" for item in search_results]
                 )
                 final_summary = f"Task Summary:\n{plan_summary}\n\nKey URLs from Search Results:\n{results_summary}"
-            else:
+            elif not page_context:
                 final_summary = f"Task Summary:\n{plan_summary}\nNo URLs or specific results were found."
+            else:
+                final_summary = f"Task Summary:\n{plan_summary}"
+
+            if page_context:
+                findings_summary = "\n".join(
+                    [
+                        f"URL: {url}\nFindings: {orjson.dumps(findings).decode()}"
+                        for url, findings in page_context.items()
+                    ]
+                )
+                final_summary = f"{final_summary}\n\nFindings from Visited Pages:\n{findings_summary}"
 
             return f"{final_summary}\nTask Status: {model_output.status}"
         except Exception as e:
@@ -293,55 +686,36 @@ class PlaywrightAutomation:
         user_id = "default_user"
         user_objective = input("Enter your objective: ")
 
-        session_messages = ""  
-        previous_plan = None
-        current_plan = "No plan yet"
+        session_messages = deque(maxlen=self.SESSION_HISTORY_STEPS)
+        previous_plan_hash = None
+        plan_str = "No plan yet"
         model_output = None  
         search_results = None  
 
-        with sync_playwright() as p:
-            browser = p.chromium.launch(headless=False)
-            page = browser.new_page()
+        browser = self._ensure_browser()
+        context = browser.new_context()
+        try:
+            page = context.new_page()
+            page.route("**/*", self.route_request)
+            page.on("framenavigated", self.clear_elements_cache)
 
+            iteration = 0
             while True:
-                self.manage_session(user_id, "load")
-
-                
-                system_prompt = f"""
-                
-                
-                You are an expert agent named MULTI·ON developed by "MultiOn" controlling a browser (you are not just a language model anymore).
-                You are given:
-                1. An objective that you are trying to achieve: {user_objective}
+                iteration += 1
+                if iteration % self.PROFILE_FLUSH_INTERVAL == 0:
+                    self.flush_profiles()
 
-                
-                Start with navigation by using "GOTO_URL" followed by the URL.
-                After navigation, inspect the page and issue the next commands based on the available elements.
-
-                IMPORTANT:
-                - Do not assume elements exist before seeing the page.
-                - Use the available elements after loading the page.
-
-                
-                {current_plan}
-
-                
-                {session_messages}
+                self.manage_session(user_id, "load")
 
                 
-                The output MUST be a JSON object following this structure:
-                {{
-                    "PLAN": [
-                        {{
-                            "step_desc": "Description of the step",
-                            "command": "Command to be executed (e.g., GOTO_URL https://example.com)"
-                        }}
-                    ],
-                    "pageContextObjects": {{}},
-                    "userInfo": {{}},
-                    "status": "DONE"  
-                }}
-                """
+                history = "\n".join(session_messages)
+                system_prompt = _SYS_PROMPT_NAV.format_map(
+                    {
+                        "objective": user_objective,
+                        "plan": plan_str,
+                        "history": history,
+                    }
+                )
 
                 
                 model_output = self.send_to_model(system_prompt)
@@ -354,58 +728,88 @@ class PlaywrightAutomation:
                 
                 commands, explanation, status = self.process_model_output(model_output)
 
-                session_messages += f"\n{json.dumps(model_output.dict(), indent=2)}"
+                session_messages.append(
+                    orjson.dumps(model_output.dict(), option=orjson.OPT_INDENT_2).decode()
+                )
 
                 print(f"Commands: {commands}")
                 print(f"Status: {status}")
 
-                current_plan = model_output.PLAN  
+                current_plan = model_output.PLAN
+                plan_bytes = self.serialize_plan(current_plan)
+                plan_str = plan_bytes.decode()
 
-                if self.check_for_stagnation(previous_plan, current_plan):
+                current_plan_hash = self.plan_digest(plan_bytes)
+                if self.check_for_stagnation(previous_plan_hash, current_plan_hash):
                     logging.warning("Stagnation detected, exiting...")
                     break
-                previous_plan = current_plan
+                previous_plan_hash = current_plan_hash
+
+                urls = self.independent_urls(commands)
+                if urls:
+                    page_contents = self.visit_urls_in_parallel(browser, urls)
+                    page_outputs = self.send_to_model(
+                        [
+                            _SYS_PROMPT_PAGE.format_map(
+                                {
+                                    "url": url,
+                                    "objective": user_objective,
+                                    "content": content[: self.PAGE_CONTENT_CHARS],
+                                }
+                            )
+                            for url, content in page_contents.items()
+                        ]
+                    )
+                    page_context = {
+                        url: output.pageContextObjects
+                        for url, output in zip(page_contents, page_outputs)
+                        if output is not None
+                    }
+                    print(f"Page findings: {page_context}")
+                    session_messages.append(
+                        orjson.dumps(page_context, option=orjson.OPT_INDENT_2).decode()
+                    )
+                    self.manage_session(user_id, "save", "\n".join(session_messages))
+
+                    if status == "DONE":
+                        logging.info("Task completed.")
+                        final_output = self.generate_final_output(
+                            model_output, search_results, page_context
+                        )
+                        print(f"Final Output: {final_output}")
+                        break
+                    elif status == "NOT SURE" or status == "WRONG":
+                        logging.warning("Model needs assistance.")
+                        break
+                    else:
+                        continue
 
                 
-                search_results = self.execute_browser_commands(page, [commands[0]], {})
+                action = None
+                if commands:
+                    search_results = self.execute_browser_commands(page, [commands[0]], {})
+                    action, _ = _split_first(commands[0])
+
+                if action in self.TERMINAL_ACTIONS or status == "DONE":
+                    self.manage_session(user_id, "save", "\n".join(session_messages))
+                    logging.info("Task completed without page interaction.")
+                    final_output = self.generate_final_output(model_output, search_results)
+                    print(f"Final Output: {final_output}")
+                    break
 
                 
                 elements = self.get_all_interactable_elements(page)
                 print(f"Elements found: {elements}")
 
                 
-                system_prompt = f"""
-                
-                
-                You are an expert agent named MULTI·ON developed by "MultiOn" controlling a browser.
-                You have successfully navigated to the page. The next steps involve interacting with the page elements.
-
-                
-                {list(elements.keys())}
-
-                
-                {current_plan}
-
-                
-                Based on the elements, choose appropriate actions like CLICK, TYPE, SUBMIT, etc.
-
-                
-                {session_messages}
-
-                
-                The output MUST be a JSON object following this structure:
-                {{
-                    "PLAN": [
-                        {{
-                            "step_desc": "Description of the step",
-                            "command": "Command to be executed (e.g., CLICK input_placeholder_0)"
-                        }}
-                    ],
-                    "pageContextObjects": {{}},
-                    "userInfo": {{}},
-                    "status": "DONE"  
-                }}
-                """
+                history = "\n".join(session_messages)
+                system_prompt = _SYS_PROMPT_INTERACT.format_map(
+                    {
+                        "elements": list(elements.keys()),
+                        "plan": plan_str,
+                        "history": history,
+                    }
+                )
 
                 
                 model_output = self.send_to_model(system_prompt)
@@ -416,13 +820,15 @@ class PlaywrightAutomation:
 
                 
                 commands, explanation, status = self.process_model_output(model_output)
-                session_messages += f"\n{json.dumps(model_output.dict(), indent=2)}"
+                session_messages.append(
+                    orjson.dumps(model_output.dict(), option=orjson.OPT_INDENT_2).decode()
+                )
 
                 
                 self.execute_browser_commands(page, commands, elements)
 
                 
-                self.manage_session(user_id, "save", session_messages)
+                self.manage_session(user_id, "save", "\n".join(session_messages))
 
                 if status == "DONE":
                     logging.info("Task completed.")
@@ -435,8 +841,13 @@ class PlaywrightAutomation:
                 else:
                     continue
 
-            
-            browser.close()
+        finally:
+            self.flush_profiles()
+            context.close()
 
 if __name__ == "__main__":
-    PlaywrightAutomation().run_automation()
+    automation = PlaywrightAutomation()
+    try:
+        automation.run_automation()
+    finally:
+        automation.close()